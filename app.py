@@ -1,38 +1,74 @@
 import streamlit as st
 import pandas as pd
-import ast
+import numpy as np
 import os
+import math
+import hashlib
 import time
 from dotenv import load_dotenv
 
 # Only import Gemini if key is present
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY') or st.secrets.get("GOOGLE_API_KEY", None)
 if GOOGLE_API_KEY:
-    import google.generativeai as genai
-    genai.configure(api_key=GOOGLE_API_KEY)
-    GEMINI_MODEL = 'models/gemini-1.5-pro-latest'
+    from google import genai
+    from google.genai import types
+    # Flash answers these short statistics questions much faster than Pro
+    GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'models/gemini-1.5-flash-latest')
+    GENERATION_CONFIG = types.GenerateContentConfig(max_output_tokens=512, temperature=0.2)
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        client = genai.Client(api_key=GOOGLE_API_KEY)
     except Exception:
-        model = None
+        client = None
 else:
-    model = None
+    client = None
 
 from streamlit_lightweight_charts import renderLightweightCharts
 
 st.set_page_config(page_title="TSLA Trading Analysis", layout="wide")
 
-def parse_list_string(s):
-    if pd.isna(s) or s == '[]':
-        return []
-    try:
-        return ast.literal_eval(s)
-    except Exception:
-        return []
+# Bump when load_data changes the shape of the parsed frame
+DATA_VERSION = 3
 
-@st.cache_data
+DIRECTIONS = pd.CategoricalDtype(['LONG', 'SHORT', 'NEUTRAL'])
+
+# Matches the numbers inside "[840, 880.5]"-style level strings
+LEVEL_PATTERN = r'-?\d*\.?\d+'
+
+def parse_levels(column):
+    # One float per level, indexed by the row it came from (NaN for no levels)
+    return column.fillna('').astype(str).str.findall(LEVEL_PATTERN).explode().astype(float)
+
+def validate_ohlc(df):
+    ohlc = df[['open', 'high', 'low', 'close']]
+    bad_nan = ohlc.isna().any(axis=1).to_numpy()
+    numeric = ohlc.apply(pd.to_numeric, errors='coerce')
+    bad_type = numeric.isna().any(axis=1).to_numpy() & ~bad_nan
+    o, h, l, c = (numeric[col].to_numpy() for col in ohlc.columns)
+    bad_logic = ~((h >= np.maximum(o, c)) & (l <= np.minimum(o, c))) & ~(bad_nan | bad_type)
+    invalid_rows = []
+    for pos in np.flatnonzero(bad_nan | bad_type | bad_logic):
+        idx = df.index[pos]
+        if bad_nan[pos]:
+            invalid_rows.append((idx, 'NaN'))
+        elif bad_type[pos]:
+            invalid_rows.append((idx, 'Non-numeric'))
+        else:
+            invalid_rows.append((idx, f'High/Low logic error: O={o[pos]}, H={h[pos]}, L={l[pos]}, C={c[pos]}'))
+    return invalid_rows
+
+# Validation runs here so its result is cached along with the frame. The frame
+# is read-only after loading, so it is shared as a resource rather than
+# pickled and copied out of st.cache_data on every rerun
+@st.cache_resource
 def load_data():
     filename = 'TSLA_data.csv'
+    # Parsed copy of the CSV, reused while it is newer than the CSV itself
+    sidecar = f'TSLA_data.v{DATA_VERSION}.parquet'
+    if os.path.exists(sidecar) and (
+        not os.path.exists(filename) or os.path.getmtime(sidecar) >= os.path.getmtime(filename)
+    ):
+        df = pd.read_parquet(sidecar)
+        return df, validate_ohlc(df)
     if not os.path.exists(filename):
         st.warning("TSLA_data.csv not found. Please upload the file below.")
         uploaded = st.file_uploader("Upload TSLA_data.csv", type=["csv"])
@@ -41,88 +77,211 @@ def load_data():
         else:
             st.stop()
     else:
-        df = pd.read_csv(filename)
-    df['Support'] = df['Support'].apply(parse_list_string)
-    df['Resistance'] = df['Resistance'].apply(parse_list_string)
+        df = pd.read_csv(filename, engine='pyarrow')
+    # Only the min/max/average of each level list is ever used, so keep those
+    # as float columns instead of object columns of Python lists
+    for column in ('Support', 'Resistance'):
+        stats = parse_levels(df[column]).groupby(level=0).agg(['min', 'max', 'mean'])
+        prefix = column.lower()
+        df[f'{prefix}_min'] = stats['min']
+        df[f'{prefix}_max'] = stats['max']
+        df[f'{prefix}_avg'] = stats['mean']
+    df = df.drop(columns=['Support', 'Resistance'])
     df['timestamp'] = pd.to_datetime(df['timestamp'])
+    # Chart time as Unix seconds, computed once for every series
+    df['time'] = (df['timestamp'] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    # Anything that is not a LONG/SHORT signal (mostly blanks) is neutral
+    df['direction'] = df['direction'].where(df['direction'].isin(['LONG', 'SHORT']), 'NEUTRAL').astype(DIRECTIONS)
+    if os.path.exists(filename):
+        try:
+            df.to_parquet(sidecar, index=False)
+        except OSError:
+            pass
+    return df, validate_ohlc(df)
+
+def build_band(times, lows, highs):
+    # Rows without levels have NaN bounds and are left out of the band
+    return [
+        {"time": t, "value": lo, "value2": hi}
+        for t, lo, hi in zip(times, lows.tolist(), highs.tolist())
+        if not math.isnan(lo)
+    ]
+
+# Marker style per signal; NEUTRAL rows get no marker
+MARKER_STYLES = {
+    'LONG': {"position": "belowBar", "color": "#26a69a", "shape": "arrowUp", "text": "LONG", "size": 2},
+    'SHORT': {"position": "aboveBar", "color": "#ef5350", "shape": "arrowDown", "text": "SHORT", "size": 2}
+}
+
+ANIMATION_FRAMES = 20
+ANIMATION_FRAME_DELAY = 0.25
+
+# Chart resolutions and their period aliases (None keeps the raw rows)
+RESOLUTIONS = {"Daily": None, "Weekly": "W", "Monthly": "M"}
+
+# Above MAX_CHART_POINTS candles, the rows are split into CHART_TARGET_POINTS
+# even-width buckets and each bucket is merged into one candle
+MAX_CHART_POINTS = 5000
+CHART_TARGET_POINTS = 3000
+
+# How each column is combined when several candles are merged into one
+CANDLE_AGGREGATIONS = {
+    'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum',
+    'support_min': 'min', 'support_max': 'max', 'support_avg': 'mean',
+    'resistance_min': 'min', 'resistance_max': 'max', 'resistance_avg': 'mean'
+}
+
+def merge_candles(df, bucket_start):
+    # Merge the rows sharing a bucket_start timestamp into one candle. Signals
+    # are not merged; build_chart_payloads places every one of them from the
+    # full frame
+    df = (
+        df[list(CANDLE_AGGREGATIONS)]
+        .groupby(bucket_start.rename('timestamp'))
+        .agg(CANDLE_AGGREGATIONS)
+        .reset_index()
+    )
+    df['time'] = (df['timestamp'] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
     return df
 
-df = load_data()
-
-# Data validation
-invalid_rows = []
-for idx, row in df.iterrows():
-    o, h, l, c = row['open'], row['high'], row['low'], row['close']
-    if pd.isna(o) or pd.isna(h) or pd.isna(l) or pd.isna(c):
-        invalid_rows.append((idx, 'NaN'))
-        continue
-    if not all(isinstance(x, (int, float)) for x in [o, h, l, c]):
-        invalid_rows.append((idx, 'Non-numeric'))
-        continue
-    if not (h >= max(o, c) and l <= min(o, c)):
-        invalid_rows.append((idx, f'High/Low logic error: O={o}, H={h}, L={l}, C={c}'))
-if invalid_rows:
-    st.warning(f"Invalid OHLC rows: {invalid_rows}")
-else:
-    st.info("All OHLC rows valid.")
+def even_buckets(n, n_out):
+    # Bucket id per row: the first and last rows alone, the rows between split
+    # into n_out - 2 buckets of (nearly) equal width
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    return np.searchsorted(edges, np.arange(n), side='right')
 
-tab1, tab2 = st.tabs(["Trading Chart", "AI Analysis"])
+# The frames passed to the cached chart helpers are derived from load_data(), so
+# they are keyed on DATA_VERSION and the resolution instead of hashing the frame
+# on every rerun
+@st.cache_data
+def downsample(_df, data_version, rule):
+    return merge_candles(_df, _df['timestamp'].dt.to_period(rule).dt.start_time)
 
-with tab1:
-    st.title("TSLA Trading Analysis")
+@st.cache_data
+def thin_candles(_df, data_version, rule):
+    # Merge each bucket into one candle timed at the bucket's first row; this
+    # keeps the true high/low instead of dropping candles outright
+    bucket = even_buckets(len(_df), CHART_TARGET_POINTS)
+    bucket_start = _df['timestamp'].groupby(bucket).transform('first')
+    return merge_candles(_df, bucket_start)
 
+@st.cache_data
+def build_chart_payloads(_df, _signals, data_version, rule):
     # Prepare candlestick data
+    times = _df['time'].tolist()
+    opens, highs, lows, closes = (_df[col].astype(float).tolist() for col in ('open', 'high', 'low', 'close'))
     candles = [
-        {
-            "time": row['timestamp'].strftime('%Y-%m-%dT%H:%M:%S'),
-            "open": float(row['open']),
-            "high": float(row['high']),
-            "low": float(row['low']),
-            "close": float(row['close'])
-        }
-        for _, row in df.iterrows()
+        {"time": t, "open": o, "high": h, "low": l, "close": c}
+        for t, o, h, l, c in zip(times, opens, highs, lows, closes)
     ]
 
     # Prepare markers with improved styling
-    markers = []
-    for idx, row in df.iterrows():
-        t = row['timestamp'].strftime('%Y-%m-%dT%H:%M:%S')
-        if row['direction'] == 'LONG':
-            markers.append({
-                "time": t,
-                "position": "belowBar",
-                "color": "#26a69a",
-                "shape": "arrowUp",
-                "text": "LONG",
-                "size": 2
-            })
-        elif row['direction'] == 'SHORT':
-            markers.append({
-                "time": t,
-                "position": "aboveBar",
-                "color": "#ef5350",
-                "shape": "arrowDown",
-                "text": "SHORT",
-                "size": 2
-            })
+    # Signals come from the unmerged _signals frame and are pinned to the candle
+    # whose bucket contains them (the last candle starting at or before them).
+    # Merged candles get at most one marker per direction, labelled with the
+    # number of signals it stands for
+    signals = _signals[_signals['direction'].isin(list(MARKER_STYLES))]
+    candle_times = _df['time'].to_numpy()
+    signal_times = candle_times[np.searchsorted(candle_times, signals['time'].to_numpy(), side='right') - 1]
+    counts = pd.DataFrame({
+        'time': signal_times,
+        'direction': signals['direction'].astype(str).to_numpy()
+    }).groupby(['time', 'direction']).size()
+    markers = [
+        {"time": t, **MARKER_STYLES[d], "text": d if n == 1 else f"{d} x{n}"}
+        for (t, d), n in counts.items()
+    ]
 
     # Prepare support/resistance bands with improved styling
-    support_area = []
-    resistance_area = []
-    for _, row in df.iterrows():
-        t = row['timestamp'].strftime('%Y-%m-%dT%H:%M:%S')
-        if row['Support']:
-            support_area.append({
-                "time": t,
-                "value": min(row['Support']),
-                "value2": max(row['Support'])
-            })
-        if row['Resistance']:
-            resistance_area.append({
-                "time": t,
-                "value": min(row['Resistance']),
-                "value2": max(row['Resistance'])
-            })
+    support_area = build_band(times, _df['support_min'], _df['support_max'])
+    resistance_area = build_band(times, _df['resistance_min'], _df['resistance_max'])
+
+    return candles, markers, support_area, resistance_area
+
+# The data is static for the lifetime of the process, so the statistics
+# part of the prompt only needs building once per data version
+@st.cache_data(show_spinner=False)
+def ai_preamble(_df, data_version):
+    # Enhanced data context
+    stats = _df[[
+        'low', 'high', 'volume',
+        'support_min', 'support_max', 'support_avg',
+        'resistance_min', 'resistance_max', 'resistance_avg'
+    ]].agg(['min', 'max', 'mean'])
+    context = {
+        "date_range": f"{_df['timestamp'].min().strftime('%Y-%m-%d')} to {_df['timestamp'].max().strftime('%Y-%m-%d')}",
+        "price_range": f"{stats.loc['min', 'low']:.2f} to {stats.loc['max', 'high']:.2f}",
+        "signals": _df['direction'].value_counts().to_dict(),
+        "support_stats": {
+            "average": stats.loc['mean', 'support_avg'],
+            "max": stats.loc['max', 'support_max'],
+            "min": stats.loc['min', 'support_min']
+        },
+        "resistance_stats": {
+            "average": stats.loc['mean', 'resistance_avg'],
+            "max": stats.loc['max', 'resistance_max'],
+            "min": stats.loc['min', 'resistance_min']
+        },
+        "volume_stats": {
+            "average": stats.loc['mean', 'volume'],
+            "max": stats.loc['max', 'volume'],
+            "min": stats.loc['min', 'volume']
+        },
+        # A short CSV preview costs far fewer prompt tokens than a dict repr
+        "sample_data": _df.drop(columns=['time']).head(3).to_csv(index=False, float_format='%.2f')
+    }
+    return f"""
+    You are analyzing TSLA stock data with the following characteristics:
+
+    Date Range: {context['date_range']}
+    Price Range: ${context['price_range']}
+
+    Trading Signals:
+    - LONG: {context['signals']['LONG']} occurrences
+    - SHORT: {context['signals']['SHORT']} occurrences
+    - NEUTRAL: {context['signals']['NEUTRAL']} occurrences
+
+    Support Levels:
+    - Average: {context['support_stats']['average']:.2f}
+    - Max: {context['support_stats']['max']:.2f}
+    - Min: {context['support_stats']['min']:.2f}
+
+    Resistance Levels:
+    - Average: {context['resistance_stats']['average']:.2f}
+    - Max: {context['resistance_stats']['max']:.2f}
+    - Min: {context['resistance_stats']['min']:.2f}
+
+    Volume Statistics:
+    - Average: {context['volume_stats']['average']:.2f}
+    - Max: {context['volume_stats']['max']:.2f}
+    - Min: {context['volume_stats']['min']:.2f}
+
+    Sample Data (CSV):
+{context['sample_data']}
+"""
+
+df, invalid_rows = load_data()
+
+if invalid_rows:
+    st.warning(f"Invalid OHLC rows: {invalid_rows}")
+else:
+    st.info("All OHLC rows valid.")
+
+tab1, tab2 = st.tabs(["Trading Chart", "AI Analysis"])
+
+# Each tab is a fragment so interacting with one doesn't rerun the other
+@st.fragment
+def chart_panel():
+    st.title("TSLA Trading Analysis")
+
+    resolution = st.selectbox("Candle resolution", list(RESOLUTIONS))
+    rule = RESOLUTIONS[resolution]
+    chart_df = df if rule is None else downsample(df, DATA_VERSION, rule)
+    if len(chart_df) > MAX_CHART_POINTS:
+        chart_df = thin_candles(chart_df, DATA_VERSION, rule)
+    candles, markers, support_area, resistance_area = build_chart_payloads(chart_df, df, DATA_VERSION, rule)
 
     # Enhanced chart config with TradingView-like styling
     chart_dict = {
@@ -214,20 +373,39 @@ with tab1:
     # Animation controls
     st.write("")
     play = st.button("Start Animation")
+    chart_placeholder = st.empty()
     if play:
-        for i in range(10, len(candles)+1):
-            chart_dict["series"][0]["data"] = candles[:i]
-            chart_dict["series"][0]["markers"] = markers[:i]
-            support_count = sum(1 for j in range(i) if df.iloc[j]['Support'])
-            resistance_count = sum(1 for j in range(i) if df.iloc[j]['Resistance'])
-            chart_dict["series"][1]["data"] = support_area[:support_count]
-            chart_dict["series"][2]["data"] = resistance_area[:resistance_count]
-            renderLightweightCharts([chart_dict], key=f"chart_anim_{i}")
-            time.sleep(0.1)
+        # Number of band points belonging to the first i candles
+        support_prefix = np.concatenate([[0], chart_df['support_min'].notna().cumsum()])
+        resistance_prefix = np.concatenate([[0], chart_df['resistance_min'].notna().cumsum()])
+        # Grow the series in place, appending only the points each frame adds
+        candle_data, support_data, resistance_data = [], [], []
+        chart_dict["series"][0]["data"] = candle_data
+        chart_dict["series"][0]["markers"] = []
+        chart_dict["series"][1]["data"] = support_data
+        chart_dict["series"][2]["data"] = resistance_data
+        # A fixed number of frames keeps playback cost independent of the data size
+        steps = np.unique(np.linspace(min(10, len(candles)), len(candles), ANIMATION_FRAMES, dtype=int))
+        shown = 0
+        for i in steps:
+            candle_data.extend(candles[shown:i])
+            support_data.extend(support_area[support_prefix[shown]:support_prefix[i]])
+            resistance_data.extend(resistance_area[resistance_prefix[shown]:resistance_prefix[i]])
+            shown = i
+            # Markers are the expensive part to lay out, so only the final frame gets them
+            if i == len(candles):
+                chart_dict["series"][0]["markers"] = markers
+            # Streamlit rejects duplicate component keys within a run, so the
+            # key still changes per frame; the placeholder keeps a single chart.
+            with chart_placeholder.container():
+                renderLightweightCharts([chart_dict], key=f"chart_anim_{i}")
+            time.sleep(ANIMATION_FRAME_DELAY)
     else:
-        renderLightweightCharts([chart_dict], key="chart_full")
+        with chart_placeholder.container():
+            renderLightweightCharts([chart_dict], key="chart_full")
 
-with tab2:
+@st.fragment
+def chat_panel():
     st.title("AI Analysis of TSLA Data")
     st.markdown("**Sample questions:**")
     st.markdown("- How many days in 2023 was TSLA bullish?")
@@ -246,72 +424,33 @@ with tab2:
         st.session_state.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
-        # Enhanced data context
-        context = {
-            "date_range": f"{df['timestamp'].min().strftime('%Y-%m-%d')} to {df['timestamp'].max().strftime('%Y-%m-%d')}",
-            "price_range": f"{df['low'].min():.2f} to {df['high'].max():.2f}",
-            "signals": {
-                "LONG": (df['direction'] == 'LONG').sum(),
-                "SHORT": (df['direction'] == 'SHORT').sum(),
-                "NEUTRAL": ((df['direction'] != 'LONG') & (df['direction'] != 'SHORT')).sum()
-            },
-            "support_stats": {
-                "average": df['Support'].apply(lambda x: sum(x)/len(x) if len(x) > 0 else 0).mean(),
-                "max": df['Support'].apply(lambda x: max(x) if len(x) > 0 else 0).max(),
-                "min": df['Support'].apply(lambda x: min(x) if len(x) > 0 else 0).min()
-            },
-            "resistance_stats": {
-                "average": df['Resistance'].apply(lambda x: sum(x)/len(x) if len(x) > 0 else 0).mean(),
-                "max": df['Resistance'].apply(lambda x: max(x) if len(x) > 0 else 0).max(),
-                "min": df['Resistance'].apply(lambda x: min(x) if len(x) > 0 else 0).min()
-            },
-            "volume_stats": {
-                "average": df['volume'].mean(),
-                "max": df['volume'].max(),
-                "min": df['volume'].min()
-            },
-            "sample_data": df.head(3).to_dict(orient='records')
-        }
-        full_context = f"""
-        You are analyzing TSLA stock data with the following characteristics:
-
-        Date Range: {context['date_range']}
-        Price Range: ${context['price_range']}
-
-        Trading Signals:
-        - LONG: {context['signals']['LONG']} occurrences
-        - SHORT: {context['signals']['SHORT']} occurrences
-        - NEUTRAL: {context['signals']['NEUTRAL']} occurrences
+        full_context = ai_preamble(df, DATA_VERSION) + f"""
+    Please analyze this data and answer the user's question: {prompt}
+"""
 
-        Support Levels:
-        - Average: {context['support_stats']['average']:.2f}
-        - Max: {context['support_stats']['max']:.2f}
-        - Min: {context['support_stats']['min']:.2f}
-
-        Resistance Levels:
-        - Average: {context['resistance_stats']['average']:.2f}
-        - Max: {context['resistance_stats']['max']:.2f}
-        - Min: {context['resistance_stats']['min']:.2f}
-
-        Volume Statistics:
-        - Average: {context['volume_stats']['average']:.2f}
-        - Max: {context['volume_stats']['max']:.2f}
-        - Min: {context['volume_stats']['min']:.2f}
-
-        Sample Data:
-        {context['sample_data']}
-
-        Please analyze this data and answer the user's question: {prompt}
-        """
-
-        if model:
+        if client:
+            # Repeated questions are answered from the session without another API call
+            llm_cache = st.session_state.setdefault("llm_cache", {})
+            cache_key = hashlib.blake2b(full_context.encode(), digest_size=16).hexdigest()
             try:
-                response = model.generate_content(full_context)
-                st.session_state.messages.append({"role": "assistant", "content": response.text})
                 with st.chat_message("assistant"):
-                    st.markdown(response.text)
+                    if cache_key in llm_cache:
+                        response_text = llm_cache[cache_key]
+                        st.markdown(response_text)
+                    else:
+                        response = client.models.generate_content_stream(
+                            model=GEMINI_MODEL, contents=full_context, config=GENERATION_CONFIG
+                        )
+                        response_text = st.write_stream(chunk.text or "" for chunk in response)
+                        llm_cache[cache_key] = response_text
+                st.session_state.messages.append({"role": "assistant", "content": response_text})
             except Exception as e:
                 st.error(f"Error generating response: {str(e)}")
         else:
             st.warning("Please set your GOOGLE_API_KEY to enable AI analysis.")
 
+with tab1:
+    chart_panel()
+
+with tab2:
+    chat_panel()
@@ -1,5 +1,6 @@
-import google.generativeai as genai
+from google import genai
 import os
 
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
-print([m.name for m in genai.list_models()])
\ No newline at end of file
+if __name__ == '__main__':
+    client = genai.Client(api_key=os.getenv('GOOGLE_API_KEY'))
+    print([m.name for m in client.models.list()])
\ No newline at end of file